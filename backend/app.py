@@ -1,13 +1,19 @@
 from flask import Flask, jsonify
-from flask_login import LoginManager
+from flask_login import LoginManager, login_required
 from models import db, User
 from auth import auth_bp
 from chats import chats_bp
+from usage import usage_bp
 from config import Config
+from scheduler import llm_scheduler
+from migrations import upgrade
+from providers import prewarm, CLIENT_FACTORIES
+from json_provider import get_json_provider_class
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = get_json_provider_class(app.config['JSON_PROVIDER'])(app)
     
     # Initialize extensions
     db.init_app(app)
@@ -22,16 +28,40 @@ def create_app():
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(chats_bp, url_prefix='/api')
+    app.register_blueprint(usage_bp, url_prefix='/api')
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    # Apply pending schema migrations
+    if app.config['RUN_MIGRATIONS_ON_STARTUP']:
+        with app.app_context():
+            upgrade(db.engine)
+    
+    # Import provider SDKs up front; with a preloading server this happens once before forking
+    if app.config['PREWARM_PROVIDERS']:
+        unknown = prewarm(app.config['PREWARM_PROVIDERS'])
+        if unknown:
+            # A typo shouldn't stop workers from booting; the SDK is then loaded on first use
+            app.logger.warning(
+                f"Ignoring unknown PREWARM_PROVIDERS {', '.join(unknown)}; expected {', '.join(CLIENT_FACTORIES)}"
+            )
+    
+    # Each worker indexes messages for semantic search in the background from its first request
+    if app.config['SEMANTIC_SEARCH_ENABLED']:
+        @app.before_request
+        def start_semantic_indexer():
+            from semantic import get_semantic_index
+            get_semantic_index(app)
     
     # Health check endpoint
     @app.route('/api/health', methods=['GET'])
     def health_check():
         return jsonify({'status': 'healthy', 'message': 'OwnChat API is running'}), 200
     
+    # LLM scheduler queue metrics
+    @app.route('/api/metrics/scheduler', methods=['GET'])
+    @login_required
+    def scheduler_metrics():
+        return jsonify(llm_scheduler.metrics()), 200
+    
     # Error handlers
     @app.errorhandler(403)
     def forbidden(error):
@@ -0,0 +1,87 @@
+"""Read endpoint benchmark.
+
+Seeds a throwaway SQLite database with one user, a number of chats and one
+large chat, then reports wall-clock and CPU time per request for the list,
+history and search endpoints.
+
+    python benchmark.py [--messages 1000] [--chats 50] [--requests 50]
+    JSON_PROVIDER=default python benchmark.py   # compare serializers
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def seed(db, User, Chat, Message, chat_count, message_count):
+    user = User(email='bench@example.com', name='Bench')
+    user.set_password('benchmark-password')
+    db.session.add(user)
+    db.session.flush()
+
+    start = datetime.utcnow() - timedelta(days=1)
+    chats = [Chat(user_id=user.id, title=f'Chat {i}', model='gpt-4') for i in range(chat_count)]
+    db.session.add_all(chats)
+    db.session.flush()
+
+    big_chat = chats[0]
+    rows = []
+    for i in range(message_count):
+        rows.append({
+            'chat_id': big_chat.id,
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': f'Message {i} about database sharding and replication. ' * 8,
+            'created_at': start + timedelta(seconds=i),
+        })
+    db.session.execute(db.insert(Message), rows)
+    db.session.commit()
+    return big_chat.id
+
+
+def measure(client, path, requests):
+    client.get(path)  # warm up
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(requests):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    wall = (time.perf_counter() - wall_start) / requests
+    cpu = (time.process_time() - cpu_start) / requests
+    return wall * 1000, cpu * 1000, len(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the read endpoints')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "benchmark.db")}'
+
+    from app import create_app
+    from models import db, User, Chat, Message
+
+    app = create_app()
+    with app.app_context():
+        chat_id = seed(db, User, Chat, Message, args.chats, args.messages)
+
+    client = app.test_client()
+    client.post('/api/auth/login', json={'email': 'bench@example.com', 'password': 'benchmark-password'})
+
+    print(f'JSON provider: {type(app.json).__name__}, {args.messages} messages, {args.chats} chats')
+    print(f'{"endpoint":<28}{"wall ms":>10}{"cpu ms":>10}{"bytes":>10}')
+    for label, path in (
+        ('GET /api/chats', '/api/chats'),
+        ('GET /api/chats/<id>', f'/api/chats/{chat_id}'),
+        ('GET /api/chats/search', '/api/chats/search?q=sharding'),
+    ):
+        wall, cpu, size = measure(client, path, args.requests)
+        print(f'{label:<28}{wall:>10.2f}{cpu:>10.2f}{size:>10}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_login import login_required, current_user
 from models import db, User, Chat, Message
 from config import Config
-import openai
-import anthropic
+from scheduler import llm_scheduler, estimate_tokens, SchedulerTimeout
+from providers import get_client, openai_completion, anthropic_completion
+from usage import record_usage
 from sqlalchemy import desc
+from sqlalchemy.orm import aliased
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 chats_bp = Blueprint('chats', __name__)
 
@@ -64,17 +67,103 @@ Response structure example:
 Always aim to be helpful, accurate, and engaging in your responses.
 """
 
-# Initialize LLM clients
-openai_client = openai.OpenAI(api_key=Config.OPENAI_API_KEY) if Config.OPENAI_API_KEY else None
-anthropic_client = anthropic.Anthropic(api_key=Config.ANTHROPIC_API_KEY) if Config.ANTHROPIC_API_KEY else None
+# Columns selected by the read endpoints, labelled with their API field names.
+# Rows are serialized with row._asdict() instead of hydrating ORM objects.
+CHAT_COLUMNS = (Chat.id, Chat.user_id, Chat.title, Chat.model, Chat.parent_chat_id, Chat.fork_message_id,
+                Chat.root_chat_id, Chat.created_at, Chat.updated_at)
+MESSAGE_COLUMNS = (Message.id, Message.chat_id, Message.role, Message.content, Message.model, Message.created_at.label('timestamp'))
+
+def message_count_column():
+    """Visible messages: inherited from a fork's ancestors plus the chat's own"""
+    own_count = db.select(db.func.count(Message.id)).where(
+        Message.chat_id == Chat.id
+    ).correlate(Chat).scalar_subquery()
+    return (Chat.inherited_message_count + own_count).label('message_count')
+
+# Queries behind the endpoints. Kept together so query_plans.py can EXPLAIN them.
+def user_chats_query(user_id):
+    return db.session.query(*CHAT_COLUMNS, message_count_column()).filter(
+        Chat.user_id == user_id
+    ).order_by(desc(Chat.updated_at))
+
+def user_chat_query(chat_id, user_id):
+    return Chat.query.filter_by(id=chat_id, user_id=user_id)
+
+def chat_messages_query(chat_id):
+    return db.session.query(*MESSAGE_COLUMNS).filter(
+        Message.chat_id == chat_id
+    ).order_by(Message.created_at, Message.id)
+
+def chat_lineage_query(chat_id):
+    """The chat and its ancestors, nearest first, in one recursive query"""
+    lineage = db.session.query(
+        Chat.id, Chat.parent_chat_id, Chat.fork_message_id, db.literal(0).label('depth')
+    ).filter(Chat.id == chat_id).cte('lineage', recursive=True)
+    parent = aliased(Chat)
+    lineage = lineage.union_all(
+        db.session.query(
+            parent.id, parent.parent_chat_id, parent.fork_message_id, lineage.c.depth + 1
+        ).filter(parent.id == lineage.c.parent_chat_id)
+    )
+    return db.session.query(lineage).order_by(lineage.c.depth)
+
+def chat_lineage(chat_id):
+    """[(chat_id, last visible message id)] from the chat up to its root. None means all messages"""
+    lineage = []
+    cutoff = None
+    for row in chat_lineage_query(chat_id).all():
+        lineage.append((row.id, cutoff))
+        # Message ids only grow, so an ancestor is visible up to the earliest fork point below it
+        if row.fork_message_id is not None:
+            cutoff = row.fork_message_id if cutoff is None else min(cutoff, row.fork_message_id)
+    return lineage
+
+def lineage_messages_query(lineage):
+    conditions = [
+        Message.chat_id == chat_id if cutoff is None else db.and_(Message.chat_id == chat_id, Message.id <= cutoff)
+        for chat_id, cutoff in lineage
+    ]
+    return db.session.query(*MESSAGE_COLUMNS).filter(db.or_(*conditions)).order_by(Message.created_at, Message.id)
+
+def chat_history_query(chat):
+    """All messages visible in a chat: the shared prefix of its ancestors, then its own"""
+    if chat.parent_chat_id is None:
+        return chat_messages_query(chat.id)
+    return lineage_messages_query(chat_lineage(chat.id))
+
+def chat_history(chat, model):
+    """The conversation sent to ``model``, keeping the reply each fork in the lineage branched off at"""
+    if chat.parent_chat_id is None:
+        return conversation_history(chat_messages_query(chat.id).all(), model)
+    lineage = chat_lineage(chat.id)
+    fork_message_ids = {cutoff for _, cutoff in lineage if cutoff is not None}
+    return conversation_history(lineage_messages_query(lineage).all(), model, fork_message_ids)
+
+def visible_message_count(chat):
+    return chat.inherited_message_count + Message.query.filter_by(chat_id=chat.id).count()
+
+def prompt_cache_key(chat):
+    """Forks share their root's key so the provider routes them to the same prompt cache"""
+    return f'ownchat-chat-{chat.root_chat_id or chat.id}'
+
+def search_chats_query(user_id, query):
+    # Correlated EXISTS so message content is only scanned within the user's chats
+    matching_message = db.session.query(Message.id).filter(
+        Message.chat_id == Chat.id,
+        Message.content.ilike(f'%{query}%')
+    ).exists()
+    return db.session.query(*CHAT_COLUMNS, message_count_column()).filter(
+        Chat.user_id == user_id,
+        db.or_(Chat.title.ilike(f'%{query}%'), matching_message)
+    ).order_by(desc(Chat.updated_at))
 
 @chats_bp.route('/chats', methods=['GET'])
 @login_required
 def get_chats():
     try:
-        chats = Chat.query.filter_by(user_id=current_user.id).order_by(desc(Chat.updated_at)).all()
+        chats = user_chats_query(current_user.id).all()
         
-        return jsonify([chat.to_dict() for chat in chats]), 200
+        return jsonify([chat._asdict() for chat in chats]), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get chats'}), 500
@@ -114,15 +203,16 @@ def create_chat():
 @login_required
 def get_chat(chat_id):
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+        chat = user_chat_query(chat_id, current_user.id).with_entities(*CHAT_COLUMNS).first()
         
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
+        messages = chat_history_query(chat).all()
         
-        chat_dict = chat.to_dict()
-        chat_dict['messages'] = [message.to_dict() for message in messages]
+        chat_dict = chat._asdict()
+        chat_dict['message_count'] = len(messages)
+        chat_dict['messages'] = [message._asdict() for message in messages]
         return jsonify(chat_dict), 200
         
     except Exception as e:
@@ -132,7 +222,7 @@ def get_chat(chat_id):
 @login_required
 def update_chat(chat_id):
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+        chat = user_chat_query(chat_id, current_user.id).first()
         
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
@@ -158,11 +248,15 @@ def update_chat(chat_id):
 @login_required
 def delete_chat(chat_id):
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+        chat = user_chat_query(chat_id, current_user.id).first()
         
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
+        # Forks read this chat's messages, so it can't go while they exist
+        if Chat.query.filter_by(parent_chat_id=chat_id).first():
+            return jsonify({'error': 'Chat has forks. Delete them first.'}), 409
+        
         db.session.delete(chat)
         db.session.commit()
         
@@ -176,7 +270,7 @@ def delete_chat(chat_id):
 @login_required
 def send_message(chat_id):
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+        chat = user_chat_query(chat_id, current_user.id).first()
         
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
@@ -191,11 +285,15 @@ def send_message(chat_id):
         if len(content) == 0:
             return jsonify({'error': 'Message cannot be empty'}), 400
         
-        # Check message limit
-        message_count = Message.query.filter_by(chat_id=chat_id).count()
+        # Check message limit, counting messages inherited from a parent chat
+        message_count = visible_message_count(chat)
         if message_count >= Config.MAX_MESSAGES_PER_CHAT:
             return jsonify({'error': f'Maximum {Config.MAX_MESSAGES_PER_CHAT} messages per chat exceeded'}), 400
         
+        # Read history before the new message is added, or autoflush would
+        # include it and the prompt would end with the same user turn twice
+        history = chat_history(chat, chat.model)
+        
         # Add user message
         user_message = Message(
             chat_id=chat_id,
@@ -206,29 +304,19 @@ def send_message(chat_id):
         
         # Generate AI response
         try:
-            ai_response = generate_ai_response(chat.model, chat_id, content)
+            reply = generate_ai_response(chat, history, content, current_user.id)
             
             # Add AI message
             ai_message = Message(
                 chat_id=chat_id,
                 role='assistant',
-                content=ai_response
+                model=chat.model,
+                **reply
             )
             db.session.add(ai_message)
+            record_usage(current_user.id, chat.model, reply)
             
-            # Update chat title intelligently
-            try:
-                if message_count == 0:
-                    # For the first exchange, always generate LLM summary from the conversation
-                    # This ensures even the first title is meaningful and context-aware
-                    chat.title = generate_chat_title_summary(chat_id, chat.model)
-                elif message_count % 4 == 1:
-                    # Update title every 4 messages to keep it relevant as conversation evolves
-                    chat.title = generate_chat_title_summary(chat_id, chat.model)
-                # Otherwise, keep existing title
-            except Exception as e:
-                # If LLM summarization fails, fallback to traditional method
-                chat.title = content[:50] + ('...' if len(content) > 50 else '')
+            refresh_chat_title(chat, message_count, content, current_user.id)
             
             db.session.commit()
             
@@ -240,7 +328,9 @@ def send_message(chat_id):
         except Exception as ai_error:
             db.session.rollback()
             error_message = str(ai_error)
-            if 'invalid_api_key' in error_message or 'Incorrect API key' in error_message:
+            if isinstance(ai_error, SchedulerTimeout):
+                return jsonify({'error': error_message}), 429
+            elif 'invalid_api_key' in error_message or 'Incorrect API key' in error_message:
                 return jsonify({'error': f'Invalid API key configured. Please check your OpenAI API key in the environment variables. Error: {error_message}'}), 401
             elif 'API key not configured' in error_message:
                 return jsonify({'error': error_message}), 401
@@ -251,6 +341,189 @@ def send_message(chat_id):
         db.session.rollback()
         return jsonify({'error': 'Failed to send message'}), 500
 
+@chats_bp.route('/chats/<int:chat_id>/compare', methods=['POST'])
+@login_required
+def compare_models(chat_id):
+    """Send one message to several models concurrently and store each reply as a sibling assistant message"""
+    try:
+        chat = user_chat_query(chat_id, current_user.id).first()
+        
+        if not chat:
+            return jsonify({'error': 'Chat not found'}), 404
+        
+        data = request.get_json()
+        
+        if not data or not data.get('content'):
+            return jsonify({'error': 'Message content is required'}), 400
+        
+        content = data['content'].strip()
+        
+        if len(content) == 0:
+            return jsonify({'error': 'Message cannot be empty'}), 400
+        
+        models = data.get('models')
+        if not isinstance(models, list) or not models:
+            return jsonify({'error': 'At least one model is required'}), 400
+        
+        if any(not isinstance(model, str) or model not in VALID_MODELS for model in models):
+            return jsonify({'error': 'Invalid model selected'}), 400
+        
+        # Drop duplicates, keeping the requested order
+        models = list(dict.fromkeys(models))
+        
+        # The user message and one reply per model must fit in the chat
+        message_count = visible_message_count(chat)
+        if message_count + 1 + len(models) > Config.MAX_MESSAGES_PER_CHAT:
+            return jsonify({'error': f'Maximum {Config.MAX_MESSAGES_PER_CHAT} messages per chat exceeded'}), 400
+        
+        # Read history before the new message is added, then fan out. Each
+        # worker only calls the provider; all database work stays on this thread.
+        history = chat_history(chat, chat.model)
+        user_id = current_user.id
+        cache_key = prompt_cache_key(chat)
+        # The whole comparison counts as one generation against the per-user
+        # cap, so all models run at once; provider rate limits still apply to each
+        try:
+            fan_out = llm_scheduler.fan_out(user_id, len(models))
+        except SchedulerTimeout as e:
+            return jsonify({'error': str(e)}), 429
+        executor = ThreadPoolExecutor(max_workers=len(models))
+        futures = {}
+        for model in models:
+            future = executor.submit(generate_model_response, model, history, content, fan_out, cache_key)
+            # Frees the user's slot after the last model, even if the client disconnects mid-stream
+            future.add_done_callback(fan_out.call_finished)
+            futures[future] = model
+        executor.shutdown(wait=False)
+        
+        user_message = Message(
+            chat_id=chat_id,
+            role='user',
+            content=content
+        )
+        db.session.add(user_message)
+        
+        def save_reply(model, reply):
+            ai_message = Message(
+                chat_id=chat_id,
+                role='assistant',
+                model=model,
+                **reply
+            )
+            db.session.add(ai_message)
+            record_usage(user_id, model, reply)
+            return ai_message
+        
+        if data.get('stream'):
+            # Newline-delimited JSON: the user message, then one line per model as it finishes
+            db.session.commit()
+            
+            def generate():
+                yield current_app.json.dumps({'user_message': user_message.to_dict()}) + '\n'
+                saved = 0
+                for future in as_completed(futures):
+                    model = futures[future]
+                    try:
+                        ai_message = save_reply(model, future.result())
+                        db.session.commit()
+                        saved += 1
+                        yield current_app.json.dumps({'model': model, 'ai_message': ai_message.to_dict()}) + '\n'
+                    except Exception as e:
+                        db.session.rollback()
+                        yield current_app.json.dumps({'model': model, 'error': str(e)}) + '\n'
+                
+                if not saved:
+                    # Like the non-streaming path, keep no user turn without a reply
+                    db.session.delete(user_message)
+                    db.session.commit()
+                    yield current_app.json.dumps({'error': 'All models failed to respond'}) + '\n'
+                    return
+                
+                refresh_chat_title(chat, message_count, content, user_id)
+                db.session.commit()
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        ai_messages = []
+        errors = {}
+        for future in as_completed(futures):
+            model = futures[future]
+            try:
+                ai_messages.append(save_reply(model, future.result()))
+            except Exception as e:
+                errors[model] = str(e)
+        
+        if not ai_messages:
+            db.session.rollback()
+            return jsonify({'error': 'All models failed to respond', 'errors': errors}), 500
+        
+        refresh_chat_title(chat, message_count, content, user_id)
+        db.session.commit()
+        
+        return jsonify({
+            'user_message': user_message.to_dict(),
+            'ai_messages': [ai_message.to_dict() for ai_message in ai_messages],
+            'errors': errors
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to compare models'}), 500
+
+@chats_bp.route('/chats/<int:chat_id>/fork', methods=['POST'])
+@login_required
+def fork_chat(chat_id):
+    """Branch a chat at one of its messages without copying the shared history"""
+    try:
+        chat = user_chat_query(chat_id, current_user.id).first()
+        
+        if not chat:
+            return jsonify({'error': 'Chat not found'}), 404
+        
+        data = request.get_json() or {}
+        try:
+            message_id = int(data['message_id'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Message to fork from is required'}), 400
+        
+        model = data.get('model', chat.model)
+        if model not in VALID_MODELS:
+            return jsonify({'error': 'Invalid model selected'}), 400
+        
+        # The fork point must be visible in this chat, either its own or inherited
+        message = db.session.get(Message, message_id)
+        lineage = chat_lineage(chat.id) if chat.parent_chat_id else [(chat.id, None)]
+        if not message or not any(
+            message.chat_id == lineage_chat_id and (cutoff is None or message.id <= cutoff)
+            for lineage_chat_id, cutoff in lineage
+        ):
+            return jsonify({'error': 'Message not found in this chat'}), 404
+        
+        # Point at the chat that owns the message, which keeps lineages as short as possible
+        parent = chat if message.chat_id == chat.id else db.session.get(Chat, message.chat_id)
+        title = data.get('title') or f'{chat.title} (fork)'
+        
+        # The parent's inherited messages all precede its own
+        inherited = Message.query.filter(Message.chat_id == parent.id, Message.id <= message.id).count()
+        fork = Chat(
+            user_id=current_user.id,
+            title=title[:255],
+            model=model,
+            parent_chat_id=parent.id,
+            fork_message_id=message.id,
+            root_chat_id=parent.root_chat_id or parent.id,
+            inherited_message_count=parent.inherited_message_count + inherited
+        )
+        
+        db.session.add(fork)
+        db.session.commit()
+        
+        return jsonify(fork.to_dict()), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to fork chat'}), 500
+
 @chats_bp.route('/chats/search', methods=['GET'])
 @login_required
 def search_chats():
@@ -260,37 +533,61 @@ def search_chats():
         if not query:
             return jsonify({'error': 'Search query is required'}), 400
         
+        if request.args.get('mode') == 'semantic':
+            if not Config.SEMANTIC_SEARCH_ENABLED:
+                return jsonify({'error': 'Semantic search is not enabled'}), 400
+            from semantic import IndexBuilding
+            try:
+                return jsonify(semantic_search_chats(current_user.id, query)), 200
+            except IndexBuilding as e:
+                return jsonify({'error': str(e)}), 503
+        
         # Search in chat titles and message content
-        chats = db.session.query(Chat).filter(
-            Chat.user_id == current_user.id,
-            db.or_(
-                Chat.title.ilike(f'%{query}%'),
-                Chat.id.in_(
-                    db.session.query(Message.chat_id).filter(
-                        Message.content.ilike(f'%{query}%')
-                    )
-                )
-            )
-        ).order_by(desc(Chat.updated_at)).all()
+        chats = search_chats_query(current_user.id, query).all()
         
-        return jsonify([chat.to_dict() for chat in chats]), 200
+        return jsonify([chat._asdict() for chat in chats]), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to search chats'}), 500
 
+def semantic_search_chats(user_id, query, limit=20):
+    """Chats ranked by embedding similarity, each with its best-matching message"""
+    # Imported here so numpy is only loaded when semantic search is used
+    from semantic import get_semantic_index
+    
+    matches = get_semantic_index(current_app._get_current_object()).search_chats(user_id, query, limit)
+    if not matches:
+        return []
+    
+    # Chats deleted since they were indexed simply drop out here
+    rows = db.session.query(*CHAT_COLUMNS, message_count_column()).filter(
+        Chat.user_id == user_id,
+        Chat.id.in_([chat_id for chat_id, _, _ in matches])
+    ).all()
+    chats = {row.id: row._asdict() for row in rows}
+    
+    results = []
+    for chat_id, score, message_id in matches:
+        chat = chats.get(chat_id)
+        if chat:
+            chat['score'] = score
+            chat['message_id'] = message_id
+            results.append(chat)
+    return results
+
 @chats_bp.route('/chats/<int:chat_id>/regenerate-title', methods=['POST'])
 @login_required
 def regenerate_chat_title(chat_id):
     """Regenerate chat title using LLM summarization"""
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+        chat = user_chat_query(chat_id, current_user.id).first()
         
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
         # Generate new title using LLM
         try:
-            new_title = generate_chat_title_summary(chat_id, chat.model)
+            new_title = generate_chat_title_summary(chat, current_user.id)
             chat.title = new_title
             db.session.commit()
             
@@ -305,18 +602,53 @@ def regenerate_chat_title(chat_id):
     except Exception as e:
         return jsonify({'error': 'Failed to regenerate chat title'}), 500
 
-def generate_ai_response(model, chat_id, user_message):
-    # Get chat history
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
-    
+def refresh_chat_title(chat, message_count, content, user_id=None):
+    """Update chat title intelligently"""
+    try:
+        if message_count == 0:
+            # For the first exchange, always generate LLM summary from the conversation
+            # This ensures even the first title is meaningful and context-aware
+            chat.title = generate_chat_title_summary(chat, user_id)
+        elif message_count % 4 == 1:
+            # Update title every 4 messages to keep it relevant as conversation evolves
+            chat.title = generate_chat_title_summary(chat, user_id)
+        # Otherwise, keep existing title
+    except Exception as e:
+        # If LLM summarization fails, fallback to traditional method
+        chat.title = content[:50] + ('...' if len(content) > 50 else '')
+
+def conversation_history(messages, model, fork_message_ids=()):
+    """Collapse compare-mode siblings so the history alternates user/assistant.
+
+    Of several consecutive assistant replies, the one a fork branched off at
+    is kept, then the one from ``model``, otherwise the first.
+    """
+    history = []
+    for msg in messages:
+        if msg.role == 'assistant' and history and history[-1].role == 'assistant':
+            kept = history[-1]
+            if kept.id not in fork_message_ids and (
+                msg.id in fork_message_ids or (msg.model == model and kept.model != model)
+            ):
+                history[-1] = msg
+            continue
+        history.append(msg)
+    return history
+
+def generate_ai_response(chat, messages, user_message, user_id=None):
+    # ``messages`` is the history before ``user_message``, including the prefix shared with parent chats
+    return generate_model_response(chat.model, messages, user_message, user_id, prompt_cache_key(chat))
+
+def generate_model_response(model, messages, user_message, user_id=None, cache_key=None):
     if model.startswith('gpt-'):
-        return generate_openai_response(model, messages, user_message)
+        return generate_openai_response(model, messages, user_message, user_id, cache_key)
     elif model.startswith('claude-'):
-        return generate_claude_response(model, messages, user_message)
+        return generate_claude_response(model, messages, user_message, user_id)
     else:
         raise ValueError(f"Unsupported model: {model}")
 
-def generate_openai_response(model, messages, user_message):
+def generate_openai_response(model, messages, user_message, user_id=None, cache_key=None):
+    openai_client = get_client('openai')
     if not openai_client:
         raise ValueError("OpenAI API key not configured. Please set OPENAI_API_KEY environment variable.")
     
@@ -341,19 +673,24 @@ def generate_openai_response(model, messages, user_message):
             "content": user_message
         })
         
-        response = openai_client.chat.completions.create(
-            model=model,
-            messages=openai_messages,
-            max_tokens=1000,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+        with llm_scheduler.slot(user_id, 'openai', estimate_tokens(openai_messages, 1000)):
+            return openai_completion(
+                openai_client,
+                model=model,
+                messages=openai_messages,
+                max_tokens=1000,
+                temperature=0.7,
+                # Prompt caching is automatic; the key keeps a chat and its forks on the same cache
+                extra_body={'prompt_cache_key': cache_key} if cache_key else None
+            )
         
+    except SchedulerTimeout:
+        raise
     except Exception as e:
         raise Exception(f"Error generating response: {str(e)}")
 
-def generate_claude_response(model, messages, user_message):
+def generate_claude_response(model, messages, user_message, user_id=None):
+    anthropic_client = get_client('anthropic')
     if not anthropic_client:
         raise ValueError("Anthropic API key not configured. Please set ANTHROPIC_API_KEY environment variable.")
     
@@ -366,29 +703,41 @@ def generate_claude_response(model, messages, user_message):
                 "content": msg.content
             })
         
+        # Cache the conversation so far. Forks send the same prefix, so they
+        # read the cache written by their parent chat.
+        if claude_messages:
+            claude_messages[-1]["content"] = [{
+                "type": "text",
+                "text": claude_messages[-1]["content"],
+                "cache_control": {"type": "ephemeral"}
+            }]
+        
         # Add current user message
         claude_messages.append({
             "role": "user",
             "content": user_message
         })
         
-        response = anthropic_client.messages.create(
-            model=model,
-            max_tokens=1000,
-            system=CLAUDE_SYSTEM_PROMPT,
-            messages=claude_messages
-        )
-        
-        return response.content[0].text
+        with llm_scheduler.slot(user_id, 'anthropic', estimate_tokens(claude_messages, 1000)):
+            return anthropic_completion(
+                anthropic_client,
+                model=model,
+                max_tokens=1000,
+                system=[{"type": "text", "text": CLAUDE_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+                messages=claude_messages
+            )
         
+    except SchedulerTimeout:
+        raise
     except Exception as e:
         raise Exception(f"Error generating response: {str(e)}")
 
-def generate_chat_title_summary(chat_id, model):
+def generate_chat_title_summary(chat, user_id=None):
     """Generate a summarized title for a chat based on all messages using LLM"""
+    model = chat.model
     try:
         # Get all messages from the chat
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
+        messages = chat_history(chat, model)
         
         if not messages:
             return "New Chat"
@@ -412,9 +761,9 @@ Title:"""
         
         # Use the same model family as the chat for consistency, but use faster models
         if model.startswith('gpt-'):
-            return generate_title_with_openai(summarization_prompt, model)
+            return generate_title_with_openai(summarization_prompt, model, user_id)
         elif model.startswith('claude-'):
-            return generate_title_with_claude(summarization_prompt, model)
+            return generate_title_with_claude(summarization_prompt, model, user_id)
         else:
             # Fallback to first message if model not supported
             first_user_msg = next((msg for msg in messages if msg.role == 'user'), None)
@@ -424,47 +773,57 @@ Title:"""
             
     except Exception as e:
         # Fallback to traditional method if LLM fails
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
+        messages = chat_history_query(chat).all()
         first_user_msg = next((msg for msg in messages if msg.role == 'user'), None)
         if first_user_msg:
             return first_user_msg.content[:50] + ('...' if len(first_user_msg.content) > 50 else '')
         return "New Chat"
 
-def generate_title_with_openai(prompt, model):
+def generate_title_with_openai(prompt, model, user_id=None):
     """Generate title using OpenAI"""
+    openai_client = get_client('openai')
     if not openai_client:
         raise ValueError("OpenAI API key not configured")
     
     # Use a fast, cost-effective model for title generation
     title_model = "gpt-3.5-turbo" if model.startswith('gpt-') else "gpt-3.5-turbo"
     
-    response = openai_client.chat.completions.create(
-        model=title_model,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=20,
-        temperature=0.3
-    )
+    title_messages = [{"role": "user", "content": prompt}]
+    with llm_scheduler.slot(user_id, 'openai', estimate_tokens(title_messages, 20)):
+        reply = openai_completion(
+            openai_client,
+            model=title_model,
+            messages=title_messages,
+            max_tokens=20,
+            temperature=0.3
+        )
+    record_usage(user_id, title_model, reply)
     
-    title = response.choices[0].message.content.strip()
+    title = reply['content'].strip()
     # Clean up the title - remove quotes and limit length
     title = title.strip('"\'').strip()
     return title[:60] if len(title) > 60 else title
 
-def generate_title_with_claude(prompt, model):
+def generate_title_with_claude(prompt, model, user_id=None):
     """Generate title using Claude"""
+    anthropic_client = get_client('anthropic')
     if not anthropic_client:
         raise ValueError("Anthropic API key not configured")
     
     # Use a fast, cost-effective model for title generation  
     title_model = "claude-3-haiku-20240307" if model.startswith('claude-') else "claude-3-haiku-20240307"
     
-    response = anthropic_client.messages.create(
-        model=title_model,
-        max_tokens=20,
-        messages=[{"role": "user", "content": prompt}]
-    )
+    title_messages = [{"role": "user", "content": prompt}]
+    with llm_scheduler.slot(user_id, 'anthropic', estimate_tokens(title_messages, 20)):
+        reply = anthropic_completion(
+            anthropic_client,
+            model=title_model,
+            max_tokens=20,
+            messages=title_messages
+        )
+    record_usage(user_id, title_model, reply)
     
-    title = response.content[0].text.strip()
+    title = reply['content'].strip()
     # Clean up the title - remove quotes and limit length
     title = title.strip('"\'').strip()
     return title[:60] if len(title) > 60 else title
\ No newline at end of file
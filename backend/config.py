@@ -28,3 +28,36 @@ class Config:
 
     # Message limits
     MAX_MESSAGES_PER_CHAT = 20
+
+    # LLM call scheduling (0 disables a rate limit)
+    MAX_CONCURRENT_GENERATIONS_PER_USER = int(os.environ.get('MAX_CONCURRENT_GENERATIONS_PER_USER', 2))
+    OPENAI_REQUESTS_PER_MINUTE = int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', 500))
+    OPENAI_TOKENS_PER_MINUTE = int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', 90000))
+    ANTHROPIC_REQUESTS_PER_MINUTE = int(os.environ.get('ANTHROPIC_REQUESTS_PER_MINUTE', 50))
+    ANTHROPIC_TOKENS_PER_MINUTE = int(os.environ.get('ANTHROPIC_TOKENS_PER_MINUTE', 40000))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 60))
+    # Set to share limits between nodes, e.g. redis://localhost:6379/0
+    SCHEDULER_REDIS_URL = os.environ.get('SCHEDULER_REDIS_URL')
+
+    # Worker startup
+    # Disable in production and run `python migrations.py upgrade` as a deploy step instead
+    RUN_MIGRATIONS_ON_STARTUP = os.environ.get('RUN_MIGRATIONS_ON_STARTUP', 'true').lower() == 'true'
+    # Comma-separated providers whose SDKs are imported at startup, e.g. openai,anthropic
+    PREWARM_PROVIDERS = [p.strip() for p in os.environ.get('PREWARM_PROVIDERS', '').split(',') if p.strip()]
+
+    # JSON serialization: 'orjson' (falls back to 'default' if orjson isn't installed) or 'default'
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson')
+
+    # Semantic search (requires numpy; sentence-transformers for a local model)
+    SEMANTIC_SEARCH_ENABLED = os.environ.get('SEMANTIC_SEARCH_ENABLED', 'false').lower() == 'true'
+    # 'hashing' (deterministic, no model) or 'sentence-transformers:<model name>'
+    SEMANTIC_EMBEDDER = os.environ.get('SEMANTIC_EMBEDDER', 'hashing')
+    # Directory for per-user index files, shared by the indexer and every worker
+    SEMANTIC_INDEX_DIR = os.environ.get('SEMANTIC_INDEX_DIR', 'semantic_index')
+    # Per-user message count above which queries use the IVF index instead of a full scan
+    SEMANTIC_ANN_THRESHOLD = int(os.environ.get('SEMANTIC_ANN_THRESHOLD', 50000))
+    SEMANTIC_INDEX_INTERVAL = float(os.environ.get('SEMANTIC_INDEX_INTERVAL', 5))
+    # Run the indexer in one worker, elected by a lock. Disable to run `python semantic.py index` instead
+    SEMANTIC_INDEXER_IN_WORKERS = os.environ.get('SEMANTIC_INDEXER_IN_WORKERS', 'true').lower() == 'true'
+    # Memory each worker may use for loaded indexes
+    SEMANTIC_MAX_LOADED_MB = int(os.environ.get('SEMANTIC_MAX_LOADED_MB', 1024))
@@ -0,0 +1,68 @@
+"""Cold-start import report.
+
+Imports the app in a fresh interpreter with ``-X importtime``, prints the
+slowest modules and fails if startup regresses: either the total import
+time exceeds the budget, or a module that must stay lazy (the provider SDKs)
+is imported at startup.
+
+    python import_report.py [--budget-ms 1000] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that are only imported on first use of a provider (see providers.py)
+LAZY_MODULES = ['openai', 'anthropic']
+
+DEFAULT_BUDGET_MS = 1000
+
+
+def import_times(module='app'):
+    """Return {module: (self_us, cumulative_us)} for a cold import of ``module``"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report and check backend import time')
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_TIME_BUDGET_MS', DEFAULT_BUDGET_MS)))
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times('app')
+    total_ms = times['app'][1] / 1000
+
+    print(f'{"cumulative ms":>14}  module')
+    for name, (_, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f'{cumulative_us / 1000:>14.1f}  {name}')
+    print(f'\nTotal: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)')
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in times]
+    if eager:
+        print(f'FAIL: imported at startup but should be lazy: {", ".join(eager)}')
+        failed = True
+    if total_ms > args.budget_ms:
+        print('FAIL: import time is over budget')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
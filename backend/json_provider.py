@@ -0,0 +1,54 @@
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library
+    orjson = None
+
+
+def _default(obj):
+    # Match the isoformat() timestamps the API has always returned
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Standard library JSON with ISO 8601 datetimes, so endpoints can return raw column values"""
+
+    default = staticmethod(_default)
+
+
+class OrjsonProvider(IsoJSONProvider):
+    """orjson-backed provider. Serializes datetimes natively in the same ISO 8601 format"""
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps(obj, kwargs.get('indent')).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._dumps(obj, indent) + b'\n', mimetype=self.mimetype)
+
+    def _dumps(self, obj, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+JSON_PROVIDERS = {
+    'default': IsoJSONProvider,
+    'orjson': OrjsonProvider,
+}
+
+
+def get_json_provider_class(name):
+    """Resolve the configured provider, falling back to the standard library when orjson is missing"""
+    if name == 'orjson' and orjson is None:
+        return IsoJSONProvider
+    return JSON_PROVIDERS[name]
@@ -0,0 +1,285 @@
+"""Versioned schema migrations.
+
+Every migration is idempotent so it can be applied to databases created by
+database/init.sql or by older releases that relied on ``db.create_all()``.
+Index builds run outside a transaction with ``CONCURRENTLY`` on PostgreSQL so
+they never block writes.
+
+Usage:
+    python migrations.py upgrade   # apply pending migrations
+    python migrations.py status    # list applied and pending migrations
+"""
+import sys
+from datetime import datetime
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, BigInteger, String, Text, Date, DateTime,
+    ForeignKey, CheckConstraint, text, inspect
+)
+
+# Arbitrary key for the PostgreSQL advisory lock taken while migrating, so
+# workers booting at the same time don't race each other
+MIGRATION_LOCK_ID = 4_240_917
+
+MIGRATIONS = []
+
+
+def migration(version, name, transactional=True):
+    """Register an upgrade function. Non-transactional migrations run in autocommit mode"""
+    def decorator(fn):
+        MIGRATIONS.append({'version': version, 'name': name, 'upgrade': fn, 'transactional': transactional})
+        return fn
+    return decorator
+
+
+def create_index(conn, name, table, columns, where=None):
+    """Create an index without blocking writes, replacing any invalid leftover from a failed build"""
+    predicate = f' WHERE {where}' if where else ''
+    if conn.dialect.name == 'postgresql':
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {'name': name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+        conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns}){predicate}'))
+    else:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}){predicate}'))
+
+
+def add_column(conn, table, column, ddl):
+    """Add a nullable column if it is missing. This is a metadata-only change on PostgreSQL"""
+    existing = {col['name'] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+@migration(1, 'initial schema')
+def initial_schema(conn):
+    # Frozen copy of the original tables; later changes belong in new migrations
+    metadata = MetaData()
+    Table(
+        'users', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('email', String(255), unique=True, nullable=False),
+        Column('password_hash', String(255)),
+        Column('name', String(100), nullable=False),
+        Column('google_id', String(100), unique=True),
+        Column('avatar_url', String(500)),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+    )
+    Table(
+        'chats', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+        Column('title', String(255), nullable=False),
+        Column('model', String(50), nullable=False),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+    )
+    Table(
+        'messages', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('chat_id', Integer, ForeignKey('chats.id'), nullable=False),
+        Column('role', String(10), nullable=False),
+        Column('content', Text, nullable=False),
+        Column('created_at', DateTime),
+        CheckConstraint("role IN ('user', 'assistant')"),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, 'composite indexes for chat listing and history', transactional=False)
+def composite_indexes(conn):
+    # Chat history: WHERE chat_id = ? ORDER BY created_at, id
+    create_index(conn, 'ix_messages_chat_id_created_at_id', 'messages', 'chat_id, created_at, id')
+    # Sidebar and search: WHERE user_id = ? ORDER BY updated_at DESC
+    create_index(conn, 'ix_chats_user_id_updated_at', 'chats', 'user_id, updated_at DESC')
+
+
+@migration(3, 'model that produced each assistant message')
+def message_model(conn):
+    add_column(conn, 'messages', 'model', 'VARCHAR(50)')
+
+
+@migration(4, 'per-message usage and daily usage rollups')
+def usage_accounting(conn):
+    add_column(conn, 'messages', 'provider_model', 'VARCHAR(100)')
+    for column in ('input_tokens', 'output_tokens', 'cached_tokens', 'latency_ms', 'ttft_ms'):
+        add_column(conn, 'messages', column, 'INTEGER')
+
+    metadata = MetaData()
+    Table(
+        'users', metadata,
+        Column('id', Integer, primary_key=True),
+    )
+    Table(
+        'usage_daily', metadata,
+        Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+        Column('day', Date, primary_key=True),
+        Column('model', String(50), primary_key=True),
+        Column('requests', Integer, nullable=False, server_default='0'),
+        Column('input_tokens', BigInteger, nullable=False, server_default='0'),
+        Column('output_tokens', BigInteger, nullable=False, server_default='0'),
+        Column('cached_tokens', BigInteger, nullable=False, server_default='0'),
+        Column('total_latency_ms', BigInteger, nullable=False, server_default='0'),
+        Column('total_ttft_ms', BigInteger, nullable=False, server_default='0'),
+    )
+    metadata.tables['usage_daily'].create(conn, checkfirst=True)
+
+
+@migration(5, 'chat forks')
+def chat_forks(conn):
+    add_column(conn, 'chats', 'parent_chat_id', 'INTEGER REFERENCES chats(id)')
+    add_column(conn, 'chats', 'fork_message_id', 'INTEGER REFERENCES messages(id)')
+    add_column(conn, 'chats', 'root_chat_id', 'INTEGER')
+
+
+@migration(6, 'index for finding forks', transactional=False)
+def chat_fork_index(conn):
+    create_index(conn, 'ix_chats_parent_chat_id', 'chats', 'parent_chat_id')
+
+
+@migration(7, 'prompt cache writes, with input_tokens covering the whole prompt')
+def cache_write_tokens(conn):
+    added = 'cache_write_tokens' not in {col['name'] for col in inspect(conn).get_columns('messages')}
+    add_column(conn, 'messages', 'cache_write_tokens', 'INTEGER')
+    add_column(conn, 'usage_daily', 'cache_write_tokens', 'BIGINT NOT NULL DEFAULT 0')
+    if added:
+        # Claude's input_tokens used to leave out cache reads. Backfill only
+        # alongside the new column so the migration can be re-run safely
+        conn.execute(text(
+            "UPDATE messages SET input_tokens = input_tokens + cached_tokens "
+            "WHERE model LIKE 'claude-%' AND cached_tokens > 0"
+        ))
+        conn.execute(text(
+            "UPDATE usage_daily SET input_tokens = input_tokens + cached_tokens "
+            "WHERE model LIKE 'claude-%' AND cached_tokens > 0"
+        ))
+
+
+@migration(8, 'inherited message count of forks')
+def inherited_message_count(conn):
+    added = 'inherited_message_count' not in {col['name'] for col in inspect(conn).get_columns('chats')}
+    add_column(conn, 'chats', 'inherited_message_count', 'INTEGER NOT NULL DEFAULT 0')
+    if added:
+        # Parents are created before their forks, so their counts are known by then
+        counts = {}
+        forks = conn.execute(text(
+            'SELECT id, parent_chat_id, fork_message_id FROM chats WHERE parent_chat_id IS NOT NULL ORDER BY id'
+        )).all()
+        for chat_id, parent_id, fork_message_id in forks:
+            own = conn.execute(
+                text('SELECT COUNT(*) FROM messages WHERE chat_id = :parent_id AND id <= :fork_message_id'),
+                {'parent_id': parent_id, 'fork_message_id': fork_message_id}
+            ).scalar()
+            counts[chat_id] = counts.get(parent_id, 0) + own
+            conn.execute(
+                text('UPDATE chats SET inherited_message_count = :count WHERE id = :id'),
+                {'count': counts[chat_id], 'id': chat_id}
+            )
+
+
+@migration(9, 'semantic indexing state of messages', transactional=False)
+def message_embedded_at(conn):
+    add_column(conn, 'messages', 'embedded_at', 'TIMESTAMP')
+    # Small partial index: only messages the semantic indexer hasn't written yet
+    create_index(conn, 'ix_messages_unembedded', 'messages', 'id', where='embedded_at IS NULL')
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, '
+            'name VARCHAR(255) NOT NULL, '
+            'applied_at TIMESTAMP NOT NULL)'
+        ))
+
+
+def applied_versions(engine):
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m['version']) if m['version'] not in applied]
+
+
+def _apply(engine, m):
+    if m['transactional']:
+        with engine.begin() as conn:
+            m['upgrade'](conn)
+    else:
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            m['upgrade'](conn)
+
+    with engine.begin() as conn:
+        conn.execute(
+            text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+            {'version': m['version'], 'name': m['name'], 'applied_at': datetime.utcnow()}
+        )
+
+
+def upgrade(engine):
+    """Apply all pending migrations in order. Returns the versions that were applied"""
+    _ensure_version_table(engine)
+
+    lock_conn = None
+    if engine.dialect.name == 'postgresql':
+        lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock_conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+
+    try:
+        applied = []
+        # Re-read under the lock: another worker may have just finished migrating
+        for m in pending_migrations(engine):
+            _apply(engine, m)
+            applied.append(m['version'])
+        return applied
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+            lock_conn.close()
+
+
+def create_cli_app():
+    """A bare app bound to the configured database, for command line tools.
+
+    Unlike create_app it never migrates on startup, so only ``upgrade`` changes
+    the schema. Relative SQLite paths still resolve to the same instance folder.
+    """
+    from flask import Flask
+    from config import Config
+    from models import db
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    return app
+
+
+def main(argv):
+    from models import db
+
+    command = argv[1] if len(argv) > 1 else 'upgrade'
+    app = create_cli_app()
+    with app.app_context():
+        if command == 'upgrade':
+            applied = upgrade(db.engine)
+            print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+        elif command == 'status':
+            applied = applied_versions(db.engine)
+            for m in sorted(MIGRATIONS, key=lambda m: m['version']):
+                state = 'applied' if m['version'] in applied else 'pending'
+                print(f"{m['version']:>4}  {state:<8} {m['name']}")
+        else:
+            print(__doc__)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
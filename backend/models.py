@@ -42,10 +42,19 @@ class Chat(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(255), nullable=False, default='New Chat')
     model = db.Column(db.String(50), nullable=False)
+    # Forks share their parent's messages up to and including fork_message_id
+    # instead of copying them. root_chat_id is the chat the lineage started from.
+    parent_chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'))
+    fork_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', use_alter=True))
+    root_chat_id = db.Column(db.Integer)
+    # Messages inherited at the fork point. The shared prefix never changes, so
+    # the visible count is this plus the chat's own messages
+    inherited_message_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan')
+    messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan',
+                               foreign_keys='Message.chat_id')
     
     def to_dict(self):
         return {
@@ -53,11 +62,19 @@ class Chat(db.Model):
             'user_id': self.user_id,
             'title': self.title,
             'model': self.model,
+            'parent_chat_id': self.parent_chat_id,
+            'fork_message_id': self.fork_message_id,
+            'root_chat_id': self.root_chat_id,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'message_count': len(self.messages)
+            'message_count': self.inherited_message_count + len(self.messages)
         }
 
+# Sidebar and search: WHERE user_id = ? ORDER BY updated_at DESC
+db.Index('ix_chats_user_id_updated_at', Chat.user_id, Chat.updated_at.desc())
+# Finding a chat's forks
+db.Index('ix_chats_parent_chat_id', Chat.parent_chat_id)
+
 class Message(db.Model):
     __tablename__ = 'messages'
     
@@ -65,9 +82,30 @@ class Message(db.Model):
     chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'), nullable=False)
     role = db.Column(db.String(10), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    # Model that generated an assistant message; compare mode stores one sibling per model
+    model = db.Column(db.String(50))
+    # Usage and timings reported for an assistant message. input_tokens is the
+    # whole prompt; cached_tokens and cache_write_tokens are the parts of it
+    # read from and written to the provider's prompt cache
+    provider_model = db.Column(db.String(100))
+    input_tokens = db.Column(db.Integer)
+    output_tokens = db.Column(db.Integer)
+    cached_tokens = db.Column(db.Integer)
+    cache_write_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    ttft_ms = db.Column(db.Integer)
+    # Set once the semantic indexer has written the message to its user's index
+    embedded_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.CheckConstraint("role IN ('user', 'assistant')"),)
+    __table_args__ = (
+        db.CheckConstraint("role IN ('user', 'assistant')"),
+        # Chat history: WHERE chat_id = ? ORDER BY created_at, id
+        db.Index('ix_messages_chat_id_created_at_id', 'chat_id', 'created_at', 'id'),
+        # Semantic indexer: WHERE embedded_at IS NULL ORDER BY id
+        db.Index('ix_messages_unembedded', 'id',
+                 postgresql_where=db.text('embedded_at IS NULL'), sqlite_where=db.text('embedded_at IS NULL')),
+    )
     
     def to_dict(self):
         return {
@@ -75,5 +113,34 @@ class Message(db.Model):
             'chat_id': self.chat_id,
             'role': self.role,
             'content': self.content,
+            'model': self.model,
             'timestamp': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class UsageDaily(db.Model):
+    """Per-user, per-model daily totals, incremented as provider calls complete"""
+    __tablename__ = 'usage_daily'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    model = db.Column(db.String(50), primary_key=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    output_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cached_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cache_write_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    total_latency_ms = db.Column(db.BigInteger, nullable=False, default=0)
+    total_ttft_ms = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'model': self.model,
+            'requests': self.requests,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
+            'avg_latency_ms': self.total_latency_ms / self.requests if self.requests else 0,
+            'avg_ttft_ms': self.total_ttft_ms / self.requests if self.requests else 0
+        }
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from config import Config
+
+# The provider SDKs take most of the backend's import time, so they are only
+# imported the first time a provider is actually used (or when prewarmed).
+_clients = {}
+_lock = threading.Lock()
+
+
+def _create_openai_client():
+    if not Config.OPENAI_API_KEY:
+        return None
+    import openai
+    return openai.OpenAI(api_key=Config.OPENAI_API_KEY)
+
+
+def _create_anthropic_client():
+    if not Config.ANTHROPIC_API_KEY:
+        return None
+    import anthropic
+    return anthropic.Anthropic(api_key=Config.ANTHROPIC_API_KEY)
+
+
+CLIENT_FACTORIES = {
+    'openai': _create_openai_client,
+    'anthropic': _create_anthropic_client,
+}
+
+
+def get_client(provider):
+    """Return the client for a provider, creating it on first use. None if no API key is configured"""
+    try:
+        return _clients[provider]
+    except KeyError:
+        pass
+
+    with _lock:
+        if provider not in _clients:
+            _clients[provider] = CLIENT_FACTORIES[provider]()
+        return _clients[provider]
+
+
+def prewarm(providers=None):
+    """Import SDKs and create clients ahead of the first request.
+
+    Safe to call before forking workers (e.g. with gunicorn --preload): the
+    imported modules are shared with the children, while the clients and
+    their connection pools are discarded in each child and rebuilt on use.
+    Returns the names that aren't known providers, which are skipped.
+    """
+    unknown = []
+    for provider in providers or CLIENT_FACTORIES:
+        if provider in CLIENT_FACTORIES:
+            get_client(provider)
+        else:
+            unknown.append(provider)
+    return unknown
+
+
+def _elapsed_ms(start):
+    return int((time.perf_counter() - start) * 1000)
+
+
+def openai_completion(client, **kwargs):
+    """Stream a chat completion, returning its text with token usage and timings"""
+    start = time.perf_counter()
+    ttft_ms = None
+    parts = []
+    usage = None
+    provider_model = kwargs.get('model')
+
+    stream = client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **kwargs)
+    for chunk in stream:
+        provider_model = chunk.model or provider_model
+        if chunk.usage:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if ttft_ms is None:
+                ttft_ms = _elapsed_ms(start)
+            parts.append(chunk.choices[0].delta.content)
+
+    # prompt_tokens already includes cached tokens; OpenAI caches without a write charge
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'content': ''.join(parts),
+        'provider_model': provider_model,
+        'input_tokens': usage.prompt_tokens if usage else None,
+        'output_tokens': usage.completion_tokens if usage else None,
+        'cached_tokens': (details.cached_tokens or 0) if details else 0,
+        'cache_write_tokens': 0,
+        'latency_ms': _elapsed_ms(start),
+        'ttft_ms': ttft_ms,
+    }
+
+
+def anthropic_completion(client, **kwargs):
+    """Stream a message, returning its text with token usage and timings"""
+    start = time.perf_counter()
+    ttft_ms = None
+    parts = []
+
+    with client.messages.stream(**kwargs) as stream:
+        for text in stream.text_stream:
+            if ttft_ms is None:
+                ttft_ms = _elapsed_ms(start)
+            parts.append(text)
+        final = stream.get_final_message()
+
+    # Anthropic reports cache reads and writes separately from input_tokens;
+    # add them back so input_tokens is the whole prompt, as with OpenAI
+    usage = final.usage
+    cached_tokens = usage.cache_read_input_tokens or 0
+    cache_write_tokens = usage.cache_creation_input_tokens or 0
+    return {
+        'content': ''.join(parts),
+        'provider_model': final.model,
+        'input_tokens': usage.input_tokens + cached_tokens + cache_write_tokens,
+        'output_tokens': usage.output_tokens,
+        'cached_tokens': cached_tokens,
+        'cache_write_tokens': cache_write_tokens,
+        'latency_ms': _elapsed_ms(start),
+        'ttft_ms': ttft_ms,
+    }
+
+
+def reset_clients():
+    """Drop cached clients so HTTP connection pools are never shared across processes"""
+    _clients.clear()
+
+
+def _after_fork_in_child():
+    # The lock may have been held by another thread at fork time
+    global _lock
+    _lock = threading.Lock()
+    reset_clients()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
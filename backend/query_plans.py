@@ -0,0 +1,111 @@
+"""Query-plan regression check.
+
+Runs EXPLAIN on the query behind every chat endpoint and fails if any of them
+falls back to a full table scan or an unindexed sort. Intended for CI against
+a migrated database:
+
+    DATABASE_URL=postgresql://... python query_plans.py
+"""
+import sys
+from datetime import date
+from sqlalchemy import text
+from models import db, Chat, Message, UsageDaily
+
+# Sorts that are expected on SQLite: they only order rows already narrowed by
+# index lookups along a fork lineage, which is a handful of chats deep
+ACCEPTED_SORTS = {
+    'GET /api/chats/<id> lineage',
+    'GET /api/chats/<id> forked messages',
+}
+
+# Recursive CTEs are read back row by row, which SQLite reports as a scan
+CTE_NAMES = {'lineage'}
+
+# Partial indexes only hold the rows a query wants, so scanning one is the point
+PARTIAL_INDEXES = {'ix_messages_unembedded'}
+
+
+def endpoint_queries(semantic=False):
+    """Representative query per endpoint, keyed by endpoint"""
+    from chats import (
+        user_chats_query, user_chat_query, chat_messages_query, search_chats_query,
+        chat_lineage_query, lineage_messages_query
+    )
+
+    queries = {
+        'GET /api/chats': user_chats_query(1),
+        'GET /api/chats/<id>': user_chat_query(1, 1),
+        'GET /api/chats/<id> messages': chat_messages_query(1),
+        'POST /api/chats/<id>/messages count': Message.query.filter_by(chat_id=1).with_entities(db.func.count()),
+        'GET /api/chats/<id> lineage': chat_lineage_query(2),
+        'GET /api/chats/<id> forked messages': lineage_messages_query([(2, None), (1, 10)]),
+        'DELETE /api/chats/<id> forks': Chat.query.filter_by(parent_chat_id=1).with_entities(Chat.id),
+        'GET /api/chats/search': search_chats_query(1, 'sharding'),
+        'GET /api/usage': UsageDaily.query.filter(UsageDaily.user_id == 1, UsageDaily.day >= date.today()),
+    }
+    if semantic:
+        from semantic import unembedded_messages_query
+
+        queries['semantic indexer pending messages'] = unembedded_messages_query(512)
+    return queries
+
+
+def explain(conn, query):
+    sql = str(query.statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+    return [row[0] for row in conn.execute(text(f'EXPLAIN {sql}'))]
+
+
+def plan_problems(dialect, plan, allow_sort=False):
+    """Lines of a plan that indicate a sequential scan or a sort the indexes should have avoided"""
+    problems = []
+    for line in plan:
+        detail = line.strip()
+        if dialect == 'sqlite':
+            if detail.startswith('SCAN ') and detail.split()[1] not in CTE_NAMES:
+                if detail.split()[-1] not in PARTIAL_INDEXES:
+                    problems.append(detail)
+            elif 'USE TEMP B-TREE' in detail and not allow_sort:
+                problems.append(detail)
+        elif 'Seq Scan' in detail:
+            problems.append(detail)
+    return problems
+
+
+def check_plans(engine, semantic=False):
+    """Returns {endpoint: [problem lines]} for every endpoint whose plan regressed"""
+    failures = {}
+    with engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            # Small test tables make seq scans look cheapest; only fall back to
+            # them when no usable index exists
+            conn.execute(text('SET enable_seqscan = off'))
+        for endpoint, query in endpoint_queries(semantic).items():
+            problems = plan_problems(conn.dialect.name, explain(conn, query), endpoint in ACCEPTED_SORTS)
+            if problems:
+                failures[endpoint] = problems
+    return failures
+
+
+def main():
+    from migrations import create_cli_app, pending_migrations
+
+    app = create_cli_app()
+    with app.app_context():
+        if pending_migrations(db.engine):
+            print('Database has pending migrations; run `python migrations.py upgrade` first')
+            return 1
+        failures = check_plans(db.engine, app.config['SEMANTIC_SEARCH_ENABLED'])
+    for endpoint, problems in failures.items():
+        print(f'{endpoint}:')
+        for problem in problems:
+            print(f'    {problem}')
+    if failures:
+        return 1
+    print('All endpoint queries use indexes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
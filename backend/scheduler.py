@@ -0,0 +1,373 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from config import Config
+
+# Results returned by a scheduler backend when asked to admit a request
+GRANTED = 'granted'
+USER_LIMITED = 'user_limited'
+RATE_LIMITED = 'rate_limited'
+
+# How often waiters re-check a shared backend, since other nodes can free
+# capacity without notifying this process
+POLL_INTERVAL = 0.5
+
+# Pseudo-provider for the slot a fan-out holds; it has no rate limits
+FAN_OUT = 'fan-out'
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waited longer than the queue timeout"""
+    pass
+
+
+def _user_key(user_id):
+    return user_id if user_id is not None else 'anonymous'
+
+
+def _content_length(content):
+    # Content is either a string or a list of content blocks
+    if isinstance(content, list):
+        return sum(len(block.get('text') or '') for block in content)
+    return len(content or '')
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token estimate (~4 characters per token) used to charge the tokens-per-minute bucket"""
+    chars = sum(_content_length(msg.get('content')) for msg in messages)
+    return chars // 4 + max_tokens
+
+
+class LocalSchedulerBackend:
+    """In-process concurrency counters and token buckets"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._buckets = {}
+
+    def _level(self, key, limit, now):
+        level, updated_at = self._buckets.get(key, (float(limit), now))
+        return min(float(limit), level + (now - updated_at) * limit / 60.0)
+
+    def try_acquire(self, user_key, provider, tokens, user_limit, rpm, tpm):
+        with self._lock:
+            if self._active.get(user_key, 0) >= user_limit:
+                return USER_LIMITED, 0.0
+
+            now = time.monotonic()
+            retry_after = 0.0
+            levels = {}
+            for key, limit, needed in ((f'{provider}:rpm', rpm, 1), (f'{provider}:tpm', tpm, tokens)):
+                if not limit:
+                    continue
+                # A single request larger than the whole bucket waits for a full bucket
+                needed = min(needed, limit)
+                level = self._level(key, limit, now)
+                if level < needed:
+                    retry_after = max(retry_after, (needed - level) * 60.0 / limit)
+                levels[key] = level - needed
+
+            if retry_after > 0:
+                return RATE_LIMITED, retry_after
+
+            for key, level in levels.items():
+                self._buckets[key] = (level, now)
+            self._active[user_key] = self._active.get(user_key, 0) + 1
+            return GRANTED, 0.0
+
+    def release(self, user_key):
+        with self._lock:
+            active = self._active.get(user_key, 0) - 1
+            if active > 0:
+                self._active[user_key] = active
+            else:
+                self._active.pop(user_key, None)
+
+
+# Atomically checks the user's concurrency cap and both provider buckets,
+# then charges them. Returns {status, retry_after}.
+#   KEYS: user counter, rpm bucket, tpm bucket
+#   ARGV: user limit, now, rpm, tpm, tokens, counter ttl
+REDIS_ACQUIRE_SCRIPT = """
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+if active >= tonumber(ARGV[1]) then
+    return {0, '0'}
+end
+
+local now = tonumber(ARGV[2])
+local specs = {{KEYS[2], tonumber(ARGV[3]), 1}, {KEYS[3], tonumber(ARGV[4]), tonumber(ARGV[5])}}
+local levels = {}
+local retry_after = 0
+for i, spec in ipairs(specs) do
+    local key, limit, needed = spec[1], spec[2], spec[3]
+    if limit > 0 then
+        needed = math.min(needed, limit)
+        local state = redis.call('HMGET', key, 'level', 'ts')
+        local level = tonumber(state[1]) or limit
+        local ts = tonumber(state[2]) or now
+        level = math.min(limit, level + (now - ts) * limit / 60.0)
+        if level < needed then
+            retry_after = math.max(retry_after, (needed - level) * 60.0 / limit)
+        end
+        levels[i] = level - needed
+    end
+end
+
+if retry_after > 0 then
+    return {-1, tostring(retry_after)}
+end
+
+for i, spec in ipairs(specs) do
+    if levels[i] then
+        redis.call('HSET', spec[1], 'level', tostring(levels[i]), 'ts', tostring(now))
+        redis.call('EXPIRE', spec[1], 120)
+    end
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[6]))
+return {1, '0'}
+"""
+
+REDIS_RELEASE_SCRIPT = """
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+if active <= 1 then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSchedulerBackend:
+    """Shares concurrency counters and token buckets between nodes through Redis"""
+
+    def __init__(self, url, prefix='ownchat:scheduler', slot_ttl=600):
+        # Only needed when a shared backend is configured
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._slot_ttl = slot_ttl
+        self._acquire = self._redis.register_script(REDIS_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(REDIS_RELEASE_SCRIPT)
+
+    def try_acquire(self, user_key, provider, tokens, user_limit, rpm, tpm):
+        status, retry_after = self._acquire(
+            keys=[
+                f'{self._prefix}:active:{user_key}',
+                f'{self._prefix}:{provider}:rpm',
+                f'{self._prefix}:{provider}:tpm',
+            ],
+            args=[user_limit, time.time(), rpm or 0, tpm or 0, tokens, self._slot_ttl],
+        )
+        if status == 1:
+            return GRANTED, 0.0
+        if status == 0:
+            return USER_LIMITED, 0.0
+        return RATE_LIMITED, float(retry_after)
+
+    def release(self, user_key):
+        self._release(keys=[f'{self._prefix}:active:{user_key}'])
+
+
+class _Ticket:
+    __slots__ = ('user_key', 'provider', 'tokens', 'user_limit', 'enqueued_at', 'granted')
+
+    def __init__(self, user_key, provider, tokens, user_limit):
+        self.user_key = user_key
+        self.provider = provider
+        self.tokens = tokens
+        self.user_limit = user_limit
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class FanOut:
+    """Concurrent calls admitted together as one of the user's generations.
+
+    Pass it to slot() in place of the user id. Up to ``size`` of its calls run
+    at once; the user's slot is released when ``size`` calls have finished.
+    """
+
+    def __init__(self, scheduler, user_key, size):
+        self.key = f'{user_key}:fan-out:{uuid.uuid4().hex}'
+        self.size = size
+        self._scheduler = scheduler
+        self._user_key = user_key
+        self._remaining = size
+        self._lock = threading.Lock()
+
+    def call_finished(self, *args):
+        """Count one call as done. Accepts and ignores a future, for add_done_callback"""
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self._scheduler._release(self._user_key)
+
+
+class LLMScheduler:
+    """Admits provider calls fairly across users.
+
+    Waiting requests are queued per user and served round-robin, subject to a
+    per-user concurrency cap and per-provider requests/tokens-per-minute buckets
+    held by the backend. The queue itself is always local to the process.
+    """
+
+    def __init__(self, backend=None, max_concurrent_per_user=2, provider_limits=None,
+                 queue_timeout=60.0, poll_interval=POLL_INTERVAL):
+        self.backend = backend or LocalSchedulerBackend()
+        self.max_concurrent_per_user = max_concurrent_per_user
+        self.provider_limits = provider_limits or {}
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()
+        self._stats = {}
+
+    @classmethod
+    def from_config(cls, config):
+        backend = None
+        if config.SCHEDULER_REDIS_URL:
+            backend = RedisSchedulerBackend(config.SCHEDULER_REDIS_URL)
+        return cls(
+            backend=backend,
+            max_concurrent_per_user=config.MAX_CONCURRENT_GENERATIONS_PER_USER,
+            provider_limits={
+                'openai': (config.OPENAI_REQUESTS_PER_MINUTE, config.OPENAI_TOKENS_PER_MINUTE),
+                'anthropic': (config.ANTHROPIC_REQUESTS_PER_MINUTE, config.ANTHROPIC_TOKENS_PER_MINUTE),
+            },
+            queue_timeout=config.LLM_QUEUE_TIMEOUT,
+        )
+
+    @contextmanager
+    def slot(self, user_id, provider, tokens=0):
+        """Block until the call may run, then hold a concurrency slot for its duration"""
+        if isinstance(user_id, FanOut):
+            ticket = _Ticket(user_id.key, provider, tokens, user_id.size)
+        else:
+            ticket = _Ticket(_user_key(user_id), provider, tokens, self.max_concurrent_per_user)
+        self._wait(ticket)
+        try:
+            yield
+        finally:
+            self._release(ticket.user_key)
+
+    def fan_out(self, user_id, size):
+        """Block until the user may start a generation, then admit ``size`` concurrent calls as that one generation"""
+        ticket = _Ticket(_user_key(user_id), FAN_OUT, 0, self.max_concurrent_per_user)
+        self._wait(ticket)
+        return FanOut(self, ticket.user_key, size)
+
+    def _release(self, user_key):
+        self.backend.release(user_key)
+        with self._cond:
+            self._dispatch()
+
+    def _wait(self, ticket):
+        deadline = ticket.enqueued_at + self.queue_timeout
+        with self._cond:
+            self._waiting.setdefault(ticket.user_key, deque()).append(ticket)
+            while True:
+                retry_after = self._dispatch()
+                if ticket.granted:
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self._record(ticket.provider, time.monotonic() - ticket.enqueued_at, timed_out=True)
+                    raise SchedulerTimeout(
+                        f'Too many requests in flight for {ticket.provider}, please try again shortly'
+                    )
+                self._cond.wait(min(remaining, retry_after or self.poll_interval, self.poll_interval))
+
+    def _dispatch(self):
+        """Grant as many queued tickets as capacity allows. Caller holds the lock.
+
+        Returns the shortest time until a rate-limited ticket could be admitted.
+        """
+        retry_after = None
+        granted_any = False
+        progressed = True
+        while progressed:
+            progressed = False
+            # Once a provider refuses the user at the front of the order, later
+            # users must not overtake them on that provider
+            blocked = set()
+            for user_key in list(self._waiting):
+                ticket = self._waiting[user_key][0]
+                if ticket.provider in blocked:
+                    continue
+
+                rpm, tpm = self.provider_limits.get(ticket.provider, (0, 0))
+                status, wait = self.backend.try_acquire(
+                    user_key, ticket.provider, ticket.tokens, ticket.user_limit, rpm, tpm
+                )
+                if status == GRANTED:
+                    ticket.granted = True
+                    self._remove(ticket)
+                    if user_key in self._waiting:
+                        # Round-robin: this user goes to the back of the line
+                        self._waiting.move_to_end(user_key)
+                    self._record(ticket.provider, time.monotonic() - ticket.enqueued_at)
+                    granted_any = progressed = True
+                    break
+                if status == RATE_LIMITED:
+                    blocked.add(ticket.provider)
+                    retry_after = wait if retry_after is None else min(retry_after, wait)
+
+        if granted_any:
+            self._cond.notify_all()
+        return retry_after
+
+    def _remove(self, ticket):
+        queue = self._waiting.get(ticket.user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiting[ticket.user_key]
+
+    def _record(self, provider, waited, timed_out=False):
+        stats = self._stats.setdefault(provider, {
+            'admitted': 0,
+            'timed_out': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        })
+        stats['timed_out' if timed_out else 'admitted'] += 1
+        stats['total_wait_seconds'] += waited
+        stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+
+    def metrics(self):
+        """Queue wait time and depth per provider"""
+        with self._cond:
+            queued = {}
+            for queue in self._waiting.values():
+                for ticket in queue:
+                    queued[ticket.provider] = queued.get(ticket.provider, 0) + 1
+
+            result = {}
+            for provider in set(self._stats) | set(queued):
+                stats = dict(self._stats.get(provider, {
+                    'admitted': 0,
+                    'timed_out': 0,
+                    'total_wait_seconds': 0.0,
+                    'max_wait_seconds': 0.0,
+                }))
+                served = stats['admitted'] + stats['timed_out']
+                stats['avg_wait_seconds'] = stats['total_wait_seconds'] / served if served else 0.0
+                stats['queued'] = queued.get(provider, 0)
+                result[provider] = stats
+            return result
+
+
+llm_scheduler = LLMScheduler.from_config(Config)
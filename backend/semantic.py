@@ -0,0 +1,669 @@
+"""Semantic search over chat history.
+
+Messages are embedded by a pluggable embedder and kept in compact per-user
+float32 index files. A single indexer, elected among the workers by a lock or
+run on its own with ``python semantic.py index``, embeds every message whose
+``embedded_at`` is still unset and writes it to its user's files. Workers only
+load those files, so queries embed nothing but the query itself. Queries are
+answered with a single matrix-vector product over the normalized vectors, or
+through an inverted-file (IVF) structure once a user's index grows past a
+size threshold.
+
+Each user has a base file, which holds the IVF structure, and a small delta
+file with the messages added since the base was last written. The indexer
+rewrites the delta on every pass and folds it into the base once it grows.
+
+Only imported when SEMANTIC_SEARCH_ENABLED is set, so numpy is not part of
+normal worker startup.
+
+Usage:
+    python semantic.py index          # run the indexer until stopped
+    python semantic.py index --once   # index pending messages and exit
+"""
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from sqlalchemy import text
+from models import db, Chat, Message
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Pending messages are fetched and embedded in batches of this size
+INDEX_BATCH_SIZE = 512
+
+# IVF tuning: k-means clusters ~ sqrt(n), trained on a sample and refreshed
+# once the index doubles in size; queries probe the closest NPROBE clusters
+IVF_TRAIN_SAMPLE = 50_000
+IVF_TRAIN_ITERATIONS = 8
+IVF_NPROBE = 16
+
+# Fold a user's delta file into the base once it holds this many rows, or
+# as many rows as the base, so neither file is rewritten too often
+DELTA_MAX_ROWS = 8192
+
+# Arbitrary key for the PostgreSQL advisory lock held by the indexer
+INDEXER_LOCK_ID = 4_240_918
+
+MARK_EMBEDDED_SQL = text('UPDATE messages SET embedded_at = :now WHERE id IN :ids').bindparams(
+    db.bindparam('ids', expanding=True)
+)
+
+RESET_USER_SQL = text("""
+    UPDATE messages SET embedded_at = NULL
+    WHERE chat_id IN (SELECT id FROM chats WHERE user_id = :user_id)
+""")
+
+
+def unembedded_messages_query(limit):
+    """Messages the indexer hasn't written yet, oldest first. Uses the partial index on embedded_at"""
+    return db.session.query(Message.id, Message.chat_id, Chat.user_id, Message.content).join(
+        Chat, Chat.id == Message.chat_id
+    ).filter(Message.embedded_at.is_(None)).order_by(Message.id).limit(limit)
+
+
+class IndexBuilding(Exception):
+    """Raised when a user's index has not been built yet"""
+    pass
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder over words and word pairs. Needs no model, used for tests"""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f'hashing:{dim}'
+
+    def _features(self, content):
+        words = TOKEN_PATTERN.findall(content.lower())
+        return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, content in enumerate(texts):
+            for feature in self._features(content):
+                h = zlib.crc32(feature.encode())
+                # The top bit picks the sign so collisions tend to cancel out
+                vectors[row, h % self.dim] += -1.0 if h & 0x80000000 else 1.0
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model, e.g. all-MiniLM-L6-v2"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f'sentence-transformers:{model_name}'
+
+    def embed(self, texts):
+        vectors = self._model.encode(list(texts), batch_size=64, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def create_embedder(spec):
+    """Build an embedder from config: 'hashing', 'hashing:<dim>' or 'sentence-transformers:<model>'"""
+    name, _, arg = spec.partition(':')
+    if name == 'hashing':
+        return HashingEmbedder(int(arg) if arg else 256)
+    if name == 'sentence-transformers':
+        return SentenceTransformerEmbedder(arg or 'all-MiniLM-L6-v2')
+    raise ValueError(f'Unknown embedder: {spec}')
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def train_ivf(vectors):
+    """Spherical k-means over a sample. Returns the centroids and each vector's cluster"""
+    rng = np.random.default_rng(0)
+    size = len(vectors)
+    cluster_count = max(1, int(np.sqrt(size)))
+    sample = vectors[rng.choice(size, min(size, max(IVF_TRAIN_SAMPLE, cluster_count * 4)), replace=False)]
+
+    centroids = sample[rng.choice(len(sample), cluster_count, replace=False)]
+    for _ in range(IVF_TRAIN_ITERATIONS):
+        labels = nearest_centroids(sample, centroids)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(cluster_count + 1))
+        filled = np.flatnonzero(np.diff(bounds))
+        sums = centroids.copy()
+        sums[filled] = np.add.reduceat(sample[order], bounds[filled], axis=0)
+        centroids = normalize(sums)
+
+    return centroids, nearest_centroids(vectors, centroids)
+
+
+def nearest_centroids(vectors, centroids, batch_size=65_536):
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        labels[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+def _write_npz(path, arrays):
+    # Per-process temporary name, then an atomic rename so readers never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def _signature(path):
+    """Changes whenever the file is replaced; None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _read_delta(path, embedder_name, generation):
+    """(message_ids, chat_ids, vectors) from a delta file written against this base generation"""
+    if os.path.exists(path):
+        with np.load(path) as data:
+            if str(data['embedder']) == embedder_name and int(data['generation']) == generation:
+                return data['message_ids'], data['chat_ids'], data['vectors']
+    return None
+
+
+class VectorIndex:
+    """Normalized float32 vectors of one user's messages, in arrays grown by doubling"""
+
+    def __init__(self, dim, capacity=1024):
+        self.dim = dim
+        self.size = 0
+        self.message_ids = np.zeros(capacity, dtype=np.int64)
+        self.chat_ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        # Bumped each time the base file is rewritten; delta files name the generation they extend
+        self.generation = 0
+        self.lock = threading.Lock()
+        # IVF structure: centroids and, per centroid, the rows closest to it
+        self._centroids = None
+        self._lists = None
+        self._trained_size = 0
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.message_ids.nbytes + self.chat_ids.nbytes
+
+    def add(self, message_ids, chat_ids, vectors):
+        with self.lock:
+            count = len(message_ids)
+            if self.size + count > len(self.message_ids):
+                # Rows are never modified once written, so views handed out
+                # before a resize stay valid
+                capacity = max(len(self.message_ids) * 2, self.size + count)
+                self.message_ids = np.resize(self.message_ids, capacity)
+                self.chat_ids = np.resize(self.chat_ids, capacity)
+                grown = np.zeros((capacity, self.dim), dtype=np.float32)
+                grown[:self.size] = self.vectors[:self.size]
+                self.vectors = grown
+
+            end = self.size + count
+            self.message_ids[self.size:end] = message_ids
+            self.chat_ids[self.size:end] = chat_ids
+            self.vectors[self.size:end] = vectors
+            if self._centroids is not None:
+                self._extend_lists(self.size, nearest_centroids(self.vectors[self.size:end], self._centroids))
+            self.size = end
+
+    def maybe_train(self, ann_threshold):
+        """(Re)build the IVF structure once the index passes the threshold or doubles in size.
+
+        Training runs outside the lock so searches continue on the old structure.
+        """
+        with self.lock:
+            size = self.size
+            if size < ann_threshold or (self._centroids is not None and size < 2 * self._trained_size):
+                return False
+            vectors = self.vectors[:size]
+
+        centroids, labels = train_ivf(vectors)
+
+        with self.lock:
+            self._centroids = centroids
+            self._lists = [np.empty(0, dtype=np.int64) for _ in range(len(centroids))]
+            self._extend_lists(0, labels)
+            if self.size > size:
+                self._extend_lists(size, nearest_centroids(self.vectors[size:self.size], centroids))
+            self._trained_size = size
+        return True
+
+    def _extend_lists(self, start, labels):
+        """Append rows start..start+len(labels) to the lists of their clusters"""
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(len(self._centroids) + 1))
+        for c in np.flatnonzero(np.diff(bounds)):
+            self._lists[c] = np.concatenate([self._lists[c], order[bounds[c]:bounds[c + 1]] + start])
+
+    def search(self, query, k, ann_threshold):
+        """Top ``k`` rows by cosine similarity as (message_ids, chat_ids, scores)"""
+        with self.lock:
+            if self.size >= ann_threshold and self._centroids is not None:
+                probe = np.argpartition(-(self._centroids @ query), min(IVF_NPROBE, len(self._centroids)) - 1)
+                candidates = np.concatenate([self._lists[c] for c in probe[:IVF_NPROBE]])
+                scores = self.vectors[candidates] @ query
+            else:
+                candidates = None
+                scores = self.vectors[:self.size] @ query
+
+            k = min(k, len(scores))
+            if k == 0:
+                return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = top if candidates is None else candidates[top]
+            return self.message_ids[rows], self.chat_ids[rows], scores[top]
+
+    def save(self, path, embedder_name):
+        with self.lock:
+            arrays = {
+                'message_ids': self.message_ids[:self.size],
+                'chat_ids': self.chat_ids[:self.size],
+                'vectors': self.vectors[:self.size],
+                'embedder': np.str_(embedder_name),
+                'generation': np.int64(self.generation),
+            }
+            if self._centroids is not None:
+                # Lists are stored back to back, with offsets[c] where list c starts
+                arrays['centroids'] = self._centroids
+                arrays['ivf_rows'] = np.concatenate(self._lists)
+                arrays['ivf_offsets'] = np.concatenate([[0], np.cumsum([len(rows) for rows in self._lists])])
+                arrays['trained_size'] = np.int64(self._trained_size)
+            _write_npz(path, arrays)
+
+    @classmethod
+    def load(cls, path, embedder_name, dim):
+        """The index in a base file, or None if it is missing or was written by a different embedder"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if 'embedder' not in data.files or str(data['embedder']) != embedder_name:
+                return None
+            size = len(data['message_ids'])
+            index = cls(dim, capacity=max(1024, size))
+            index.message_ids[:size] = data['message_ids']
+            index.chat_ids[:size] = data['chat_ids']
+            index.vectors[:size] = data['vectors']
+            index.size = size
+            index.generation = int(data['generation'])
+            if 'centroids' in data.files:
+                offsets = data['ivf_offsets']
+                rows = data['ivf_rows']
+                index._centroids = data['centroids']
+                index._lists = [rows[offsets[c]:offsets[c + 1]] for c in range(len(offsets) - 1)]
+                index._trained_size = int(data['trained_size'])
+        return index
+
+
+def _paths(index_dir, user_id):
+    base = os.path.join(index_dir, f'user_{user_id}.npz')
+    return base, os.path.join(index_dir, f'user_{user_id}.delta.npz')
+
+
+class IndexWriter:
+    """Embeds pending messages into the per-user files. Only one may run at a time, see LeaderLock"""
+
+    def __init__(self, embedder, index_dir, ann_threshold=50_000):
+        self.embedder = embedder
+        self.index_dir = index_dir
+        self.ann_threshold = ann_threshold
+        self._stale_checked = False
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _reset_stale_users(self):
+        """Start over every user whose base file was written by a different embedder"""
+        for filename in os.listdir(self.index_dir):
+            match = re.fullmatch(r'user_(\d+)\.npz', filename)
+            if match:
+                with np.load(os.path.join(self.index_dir, filename)) as data:
+                    stale = 'embedder' not in data.files or str(data['embedder']) != self.embedder.name
+                if stale:
+                    self._reset_user(int(match.group(1)))
+
+    def run_once(self):
+        """Write every pending message to its user's files. Returns how many were embedded"""
+        if not self._stale_checked:
+            self._reset_stale_users()
+            self._stale_checked = True
+        embedded = 0
+        while True:
+            rows = unembedded_messages_query(INDEX_BATCH_SIZE).all()
+            # End the read transaction before the slow embedding step
+            db.session.commit()
+            if not rows:
+                break
+
+            by_user = {}
+            for row in rows:
+                by_user.setdefault(row.user_id, []).append(row)
+
+            updates = []
+            written_ids = []
+            for user_id, user_rows in by_user.items():
+                state = self._read_state(user_id)
+                if state is None:
+                    # Written by another embedder: start the user over, these rows included
+                    self._reset_user(user_id)
+                    continue
+                # Rows already in the files are left over from a pass that stopped
+                # before marking them, so they're only marked this time
+                ids = np.fromiter((row.id for row in user_rows), dtype=np.int64, count=len(user_rows))
+                fresh = ~np.isin(ids, state['known_ids'])
+                updates.append((user_id, state, [row for row, keep in zip(user_rows, fresh) if keep]))
+                written_ids.extend(row.id for row in user_rows)
+
+            texts = [row.content for _, _, user_rows in updates for row in user_rows]
+            vectors = self.embedder.embed(texts) if texts else None
+            start = 0
+            for user_id, state, user_rows in updates:
+                if user_rows:
+                    self._append(user_id, state, user_rows, vectors[start:start + len(user_rows)])
+                    start += len(user_rows)
+            embedded += len(texts)
+
+            # Marked only after the files are written; a crash in between re-reads the rows
+            if written_ids:
+                db.session.execute(MARK_EMBEDDED_SQL, {'now': datetime.utcnow(), 'ids': written_ids})
+                db.session.commit()
+            if len(rows) < INDEX_BATCH_SIZE:
+                break
+        return embedded
+
+    def _read_state(self, user_id):
+        """Base generation and size, the current delta and every message id in the files.
+
+        None if the files were written by a different embedder.
+        """
+        base_path, delta_path = _paths(self.index_dir, user_id)
+        generation, base_ids = 0, np.empty(0, dtype=np.int64)
+        if os.path.exists(base_path):
+            # Only the arrays read here are loaded from the file
+            with np.load(base_path) as data:
+                if 'embedder' not in data.files or str(data['embedder']) != self.embedder.name:
+                    return None
+                generation = int(data['generation'])
+                base_ids = data['message_ids']
+
+        delta = _read_delta(delta_path, self.embedder.name, generation)
+        if delta is None:
+            delta = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, self.embedder.dim), np.float32))
+        return {
+            'generation': generation,
+            'base_size': len(base_ids),
+            'delta': delta,
+            'known_ids': np.concatenate([base_ids, delta[0]]),
+        }
+
+    def _append(self, user_id, state, rows, vectors):
+        base_path, delta_path = _paths(self.index_dir, user_id)
+        delta_ids, delta_chat_ids, delta_vectors = state['delta']
+        delta_ids = np.concatenate([delta_ids, [row.id for row in rows]]).astype(np.int64)
+        delta_chat_ids = np.concatenate([delta_chat_ids, [row.chat_id for row in rows]]).astype(np.int64)
+        delta_vectors = np.concatenate([delta_vectors, vectors])
+
+        if len(delta_ids) < min(DELTA_MAX_ROWS, state['base_size']):
+            _write_npz(delta_path, {
+                'message_ids': delta_ids,
+                'chat_ids': delta_chat_ids,
+                'vectors': delta_vectors,
+                'embedder': np.str_(self.embedder.name),
+                'generation': np.int64(state['generation']),
+            })
+            return
+
+        index = VectorIndex.load(base_path, self.embedder.name, self.embedder.dim) or VectorIndex(self.embedder.dim)
+        index.add(delta_ids, delta_chat_ids, delta_vectors)
+        index.maybe_train(self.ann_threshold)
+        index.generation = state['generation'] + 1
+        index.save(base_path, self.embedder.name)
+        # Readers ignore a delta from an older generation, so removing it can come second
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+
+    def _reset_user(self, user_id):
+        for path in _paths(self.index_dir, user_id):
+            if os.path.exists(path):
+                os.remove(path)
+        db.session.execute(RESET_USER_SQL, {'user_id': user_id})
+        db.session.commit()
+
+
+class LeaderLock:
+    """Elects the single indexer: a PostgreSQL advisory lock, or a file lock in the index directory"""
+
+    def __init__(self, engine, index_dir):
+        self.engine = engine
+        self.index_dir = index_dir
+        self._conn = None
+        self._file = None
+
+    @property
+    def held(self):
+        return self._conn is not None or self._file is not None
+
+    def try_acquire(self):
+        if self.held:
+            return True
+        if self.engine.dialect.name == 'postgresql':
+            conn = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+            if conn.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': INDEXER_LOCK_ID}).scalar():
+                self._conn = conn
+                return True
+            conn.close()
+            return False
+
+        import fcntl
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.index_dir, 'indexer.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._conn is not None:
+            self._conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': INDEXER_LOCK_ID})
+            self._conn.close()
+            self._conn = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _LoadedIndex:
+    __slots__ = ('index', 'base_signature', 'delta_signature', 'delta_rows')
+
+    def __init__(self, index, base_signature):
+        self.index = index
+        self.base_signature = base_signature
+        self.delta_signature = None
+        self.delta_rows = 0
+
+
+class SemanticIndex:
+    """Per-user indexes loaded read-only from the indexer's files, within a memory budget"""
+
+    def __init__(self, embedder, index_dir, ann_threshold=50_000, max_loaded_bytes=1024 * 1024 * 1024):
+        self.embedder = embedder
+        self.index_dir = index_dir
+        self.ann_threshold = ann_threshold
+        self.max_loaded_bytes = max_loaded_bytes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes reading files so one user's files are only loaded once
+        self._load_lock = threading.Lock()
+
+    def _get(self, user_id):
+        """The user's index, reloaded when the indexer has rewritten its files"""
+        base_path, delta_path = _paths(self.index_dir, user_id)
+        base_signature = _signature(base_path)
+        delta_signature = _signature(delta_path)
+
+        with self._lock:
+            loaded = self._indexes.get(user_id)
+            if loaded is not None:
+                self._indexes.move_to_end(user_id)
+        if (loaded is not None and loaded.base_signature == base_signature
+                and loaded.delta_signature == delta_signature):
+            return loaded.index
+
+        with self._load_lock:
+            if loaded is None or loaded.base_signature != base_signature:
+                index = VectorIndex.load(base_path, self.embedder.name, self.embedder.dim)
+                loaded = _LoadedIndex(index or VectorIndex(self.embedder.dim), base_signature)
+
+            if loaded.delta_signature != delta_signature:
+                # Between rewrites of the base, the delta only ever grows
+                delta = _read_delta(delta_path, self.embedder.name, loaded.index.generation)
+                if delta is not None and len(delta[0]) > loaded.delta_rows:
+                    loaded.index.add(*(array[loaded.delta_rows:] for array in delta))
+                    loaded.delta_rows = len(delta[0])
+                loaded.delta_signature = delta_signature
+
+            with self._lock:
+                self._indexes[user_id] = loaded
+                self._indexes.move_to_end(user_id)
+                total = sum(entry.index.nbytes for entry in self._indexes.values())
+                while total > self.max_loaded_bytes and len(self._indexes) > 1:
+                    _, evicted = self._indexes.popitem(last=False)
+                    total -= evicted.index.nbytes
+        return loaded.index
+
+    def _has_pending_messages(self, user_id):
+        return db.session.query(
+            Message.query.join(Chat, Chat.id == Message.chat_id).filter(
+                Chat.user_id == user_id, Message.embedded_at.is_(None)
+            ).exists()
+        ).scalar()
+
+    def search_chats(self, user_id, query, limit=20):
+        """Best-matching chats as (chat_id, score, message_id), highest score first.
+
+        Raises IndexBuilding while the user has messages but nothing indexed yet.
+        """
+        index = self._get(user_id)
+        if index.size == 0 and self._has_pending_messages(user_id):
+            raise IndexBuilding('Search index is still being built, please try again shortly')
+
+        query_vector = self.embedder.embed([query])[0]
+        # Over-fetch messages so several hits in one chat don't crowd out other chats
+        message_ids, chat_ids, scores = index.search(query_vector, limit * 5, self.ann_threshold)
+
+        best = {}
+        for message_id, chat_id, score in zip(message_ids.tolist(), chat_ids.tolist(), scores.tolist()):
+            if score <= 0:
+                # Scores are sorted, nothing after this is related at all
+                break
+            if chat_id not in best:
+                best[chat_id] = (chat_id, score, message_id)
+        return list(best.values())[:limit]
+
+
+class BackgroundIndexer(threading.Thread):
+    """Runs the indexer in whichever worker holds the leader lock; the others stand by"""
+
+    def __init__(self, app, writer, interval):
+        super().__init__(name='semantic-indexer', daemon=True)
+        self.app = app
+        self.writer = writer
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            lock = LeaderLock(db.engine, self.writer.index_dir)
+            while not self.stopped.is_set():
+                try:
+                    if lock.try_acquire():
+                        self.writer.run_once()
+                except Exception as e:
+                    self.app.logger.warning(f'Semantic indexing failed: {e}')
+                finally:
+                    db.session.remove()
+                self.stopped.wait(self.interval)
+
+
+_semantic_index = None
+_indexer = None
+_pid = None
+_setup_lock = threading.Lock()
+
+
+def get_semantic_index(app):
+    """The process-wide index, with the standby indexer thread started in this process"""
+    global _semantic_index, _indexer, _pid
+    with _setup_lock:
+        # Threads don't survive fork and their locks may be held at fork time,
+        # so each worker starts over with its own index and indexer
+        if _pid != os.getpid():
+            embedder = create_embedder(app.config['SEMANTIC_EMBEDDER'])
+            _semantic_index = SemanticIndex(
+                embedder,
+                app.config['SEMANTIC_INDEX_DIR'],
+                ann_threshold=app.config['SEMANTIC_ANN_THRESHOLD'],
+                max_loaded_bytes=app.config['SEMANTIC_MAX_LOADED_MB'] * 1024 * 1024,
+            )
+            _indexer = None
+            if app.config['SEMANTIC_INDEXER_IN_WORKERS']:
+                writer = IndexWriter(embedder, app.config['SEMANTIC_INDEX_DIR'], app.config['SEMANTIC_ANN_THRESHOLD'])
+                _indexer = BackgroundIndexer(app, writer, app.config['SEMANTIC_INDEX_INTERVAL'])
+                _indexer.start()
+            _pid = os.getpid()
+        return _semantic_index
+
+
+def main(argv):
+    from migrations import create_cli_app
+
+    command = argv[1] if len(argv) > 1 else 'index'
+    if command != 'index':
+        print(__doc__)
+        return 1
+    once = '--once' in argv[2:]
+
+    app = create_cli_app()
+    with app.app_context():
+        writer = IndexWriter(
+            create_embedder(app.config['SEMANTIC_EMBEDDER']),
+            app.config['SEMANTIC_INDEX_DIR'],
+            app.config['SEMANTIC_ANN_THRESHOLD'],
+        )
+        lock = LeaderLock(db.engine, writer.index_dir)
+        interval = app.config['SEMANTIC_INDEX_INTERVAL']
+        while not lock.try_acquire():
+            if once:
+                print('Another indexer is running')
+                return 1
+            time.sleep(interval)
+
+        try:
+            while True:
+                embedded = writer.run_once()
+                if embedded or once:
+                    print(f'Embedded {embedded} messages')
+                db.session.remove()
+                if once:
+                    return 0
+                time.sleep(interval)
+        finally:
+            lock.release()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
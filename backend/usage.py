@@ -0,0 +1,119 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from models import db, Chat, Message, UsageDaily
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+usage_bp = Blueprint('usage', __name__)
+
+# Maximum range the usage endpoint reports on
+MAX_USAGE_DAYS = 366
+
+# Works on both PostgreSQL and SQLite (3.24+)
+UPSERT_USAGE_SQL = text("""
+    INSERT INTO usage_daily (
+        user_id, day, model, requests, input_tokens, output_tokens,
+        cached_tokens, cache_write_tokens, total_latency_ms, total_ttft_ms
+    )
+    VALUES (
+        :user_id, :day, :model, 1, :input_tokens, :output_tokens,
+        :cached_tokens, :cache_write_tokens, :latency_ms, :ttft_ms
+    )
+    ON CONFLICT (user_id, day, model) DO UPDATE SET
+        requests = usage_daily.requests + 1,
+        input_tokens = usage_daily.input_tokens + excluded.input_tokens,
+        output_tokens = usage_daily.output_tokens + excluded.output_tokens,
+        cached_tokens = usage_daily.cached_tokens + excluded.cached_tokens,
+        cache_write_tokens = usage_daily.cache_write_tokens + excluded.cache_write_tokens,
+        total_latency_ms = usage_daily.total_latency_ms + excluded.total_latency_ms,
+        total_ttft_ms = usage_daily.total_ttft_ms + excluded.total_ttft_ms
+""")
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cached_tokens', 'cache_write_tokens', 'latency_ms', 'ttft_ms')
+
+
+def record_usage(user_id, model, reply):
+    """Add one provider call to the user's daily rollup, in the caller's transaction"""
+    if user_id is None:
+        return
+    params = {field: reply.get(field) or 0 for field in USAGE_FIELDS}
+    params.update(user_id=user_id, day=datetime.utcnow().date(), model=model)
+    db.session.execute(UPSERT_USAGE_SQL, params)
+
+
+@usage_bp.route('/usage', methods=['GET'])
+@login_required
+def get_usage():
+    """Daily usage per model for the current user, read from the rollup table only"""
+    try:
+        days = min(max(request.args.get('days', 30, type=int), 1), MAX_USAGE_DAYS)
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+
+        rows = UsageDaily.query.filter(
+            UsageDaily.user_id == current_user.id,
+            UsageDaily.day >= since
+        ).order_by(UsageDaily.day, UsageDaily.model).all()
+
+        by_model = {}
+        for row in rows:
+            totals = by_model.setdefault(row.model, {
+                'requests': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cached_tokens': 0,
+                'cache_write_tokens': 0,
+                'total_latency_ms': 0,
+                'total_ttft_ms': 0
+            })
+            for field in totals:
+                totals[field] += getattr(row, field)
+
+        models = {}
+        for model, totals in by_model.items():
+            requests = totals['requests']
+            models[model] = {
+                'requests': requests,
+                'input_tokens': totals['input_tokens'],
+                'output_tokens': totals['output_tokens'],
+                'cached_tokens': totals['cached_tokens'],
+                'cache_write_tokens': totals['cache_write_tokens'],
+                'avg_latency_ms': totals['total_latency_ms'] / requests if requests else 0,
+                'avg_ttft_ms': totals['total_ttft_ms'] / requests if requests else 0
+            }
+
+        return jsonify({
+            'since': since.isoformat(),
+            'days': [row.to_dict() for row in rows],
+            'models': models
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to get usage'}), 500
+
+
+@usage_bp.route('/usage/chats/<int:chat_id>', methods=['GET'])
+@login_required
+def get_chat_usage(chat_id):
+    """Usage of a single chat, summed from its (bounded) messages"""
+    try:
+        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+
+        if not chat:
+            return jsonify({'error': 'Chat not found'}), 404
+
+        row = db.session.query(
+            db.func.count(Message.latency_ms).label('requests'),
+            db.func.coalesce(db.func.sum(Message.input_tokens), 0).label('input_tokens'),
+            db.func.coalesce(db.func.sum(Message.output_tokens), 0).label('output_tokens'),
+            db.func.coalesce(db.func.sum(Message.cached_tokens), 0).label('cached_tokens'),
+            db.func.coalesce(db.func.sum(Message.cache_write_tokens), 0).label('cache_write_tokens'),
+            db.cast(db.func.avg(Message.latency_ms), db.Float).label('avg_latency_ms'),
+            db.cast(db.func.avg(Message.ttft_ms), db.Float).label('avg_ttft_ms')
+        ).filter(Message.chat_id == chat_id, Message.role == 'assistant').one()
+
+        usage = row._asdict()
+        usage['chat_id'] = chat_id
+        return jsonify(usage), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to get chat usage'}), 500
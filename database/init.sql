@@ -23,6 +23,10 @@ CREATE TABLE chats (
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     title VARCHAR(255) NOT NULL DEFAULT 'New Chat',
     model VARCHAR(50) NOT NULL,
+    parent_chat_id INTEGER REFERENCES chats(id),
+    fork_message_id INTEGER,
+    root_chat_id INTEGER,
+    inherited_message_count INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -33,15 +37,48 @@ CREATE TABLE messages (
     chat_id INTEGER REFERENCES chats(id) ON DELETE CASCADE,
     role VARCHAR(10) NOT NULL CHECK (role IN ('user', 'assistant')),
     content TEXT NOT NULL,
+    model VARCHAR(50),
+    provider_model VARCHAR(100),
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cached_tokens INTEGER,
+    cache_write_tokens INTEGER,
+    latency_ms INTEGER,
+    ttft_ms INTEGER,
+    embedded_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create daily usage rollup table (incremented as provider calls complete)
+CREATE TABLE usage_daily (
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    model VARCHAR(50) NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    cached_tokens BIGINT NOT NULL DEFAULT 0,
+    cache_write_tokens BIGINT NOT NULL DEFAULT 0,
+    total_latency_ms BIGINT NOT NULL DEFAULT 0,
+    total_ttft_ms BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, model)
+);
+
 -- Create indexes for better performance
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_google_id ON users(google_id);
 CREATE INDEX idx_chats_user_id ON chats(user_id);
 CREATE INDEX idx_messages_chat_id ON messages(chat_id);
 CREATE INDEX idx_messages_created_at ON messages(created_at);
+-- Composite indexes for the hot queries (also created by backend/migrations.py)
+CREATE INDEX ix_messages_chat_id_created_at_id ON messages(chat_id, created_at, id);
+CREATE INDEX ix_messages_unembedded ON messages(id) WHERE embedded_at IS NULL;
+CREATE INDEX ix_chats_user_id_updated_at ON chats(user_id, updated_at DESC);
+CREATE INDEX ix_chats_parent_chat_id ON chats(parent_chat_id);
+
+-- Forks point at the message they branched from
+ALTER TABLE chats ADD CONSTRAINT chats_fork_message_id_fkey
+    FOREIGN KEY (fork_message_id) REFERENCES messages(id);
 
 -- Create function to update timestamps
 CREATE OR REPLACE FUNCTION update_updated_at_column()
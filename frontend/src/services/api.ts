@@ -10,6 +10,9 @@ import {
   CreateChatRequest,
   SendMessageRequest,
   SendMessageResponse,
+  CompareModelsRequest,
+  ForkChatRequest,
+  CompareModelsResponse,
   ChatSearchResult
 } from '../types';
 
@@ -93,9 +96,9 @@ export const chatAPI = {
     await api.delete(`/api/chats/${chatId}`);
   },
 
-  searchChats: async (query: string): Promise<ChatSearchResult[]> => {
+  searchChats: async (query: string, mode: 'keyword' | 'semantic' = 'keyword'): Promise<ChatSearchResult[]> => {
     const response: AxiosResponse<ChatSearchResult[]> = await api.get('/api/chats/search', {
-      params: { q: query }
+      params: { q: query, mode }
     });
     return response.data;
   },
@@ -113,6 +116,16 @@ export const messageAPI = {
     return response.data;
   },
 
+  compareModels: async (chatId: string, compareData: CompareModelsRequest): Promise<CompareModelsResponse> => {
+    const response: AxiosResponse<CompareModelsResponse> = await api.post(`/api/chats/${chatId}/compare`, compareData);
+    return response.data;
+  },
+
+  forkChat: async (chatId: string, forkData: ForkChatRequest): Promise<Chat> => {
+    const response: AxiosResponse<Chat> = await api.post(`/api/chats/${chatId}/fork`, forkData);
+    return response.data;
+  },
+
   getMessages: async (chatId: string): Promise<Message[]> => {
     const response: AxiosResponse<Message[]> = await api.get(`/api/chats/${chatId}/messages`);
     return response.data;
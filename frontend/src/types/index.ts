@@ -10,6 +10,7 @@ export interface Message {
   id: string;
   content: string;
   role: 'user' | 'assistant';
+  model?: string | null;
   timestamp: string;
   chat_id: string;
 }
@@ -18,6 +19,9 @@ export interface Chat {
   id: string;
   title: string;
   model: string;
+  parent_chat_id?: string | null;
+  fork_message_id?: string | null;
+  root_chat_id?: string | null;
   created_at: string;
   updated_at: string;
   message_count: number;
@@ -60,6 +64,23 @@ export interface SendMessageResponse {
   ai_message: Message;
 }
 
+export interface ForkChatRequest {
+  message_id: string;
+  model?: string;
+  title?: string;
+}
+
+export interface CompareModelsRequest {
+  content: string;
+  models: string[];
+}
+
+export interface CompareModelsResponse {
+  user_message: Message;
+  ai_messages: Message[];
+  errors: Record<string, string>;
+}
+
 export interface ChatSearchResult {
   id: string;
   title: string;
@@ -67,4 +88,6 @@ export interface ChatSearchResult {
   created_at: string;
   updated_at: string;
   message_count: number;
+  score?: number;
+  message_id?: string;
 }
\ No newline at end of file